@@ -1,16 +1,22 @@
 import asyncio
+import functools
 import json
 import re
 import os
 import logging
 import random
 import argparse
+import atexit
+import copy
 import sys
-from typing import Set, Optional, Dict, Any, List, Union
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields, asdict
+from typing import Set, Optional, Dict, Any, Awaitable, Callable, List, Mapping, Union
 
 import aiohttp
 from pyrogram import Client
-from pyrogram.errors import FloodWait
+from pyrogram.errors import ChannelInvalid, ChannelPrivate, FloodWait, PeerIdInvalid, UsernameInvalid, UsernameNotOccupied
 
 class ColoredFormatter(logging.Formatter):
     COLORS = {
@@ -57,6 +63,64 @@ def setup_logger():
 
 logger = setup_logger()
 
+@functools.lru_cache(maxsize=32)
+def _cached_json_load(path: str, mtime_ns: int) -> Any:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def load_json(path: str) -> Any:
+    # Файл разбирается заново только если изменилось время его модификации.
+    return _cached_json_load(path, os.stat(path).st_mtime_ns)
+
+@dataclass(slots=True)
+class ConfigData:
+    api_id: str
+    api_hash: str
+    phone_number: str
+    lolz_token: str
+    forum_thread_id: str
+    stars_count: int = 3
+    check_interval: float = 30
+    # По умолчанию границы адаптивного опроса выводятся из check_interval.
+    min_check_interval: Optional[float] = None
+    max_check_interval: Optional[float] = None
+    api_delay: float = 5
+    max_retries: int = 3
+    processed_posts_file: str = "processed_posts.json"
+    enable_reply: bool = True
+    reply_templates: List[str] = field(default_factory=lambda: ["Готово! Отправил звезды. ⭐", "Выполнено.", "Сделал.", "+rep"])
+    skip_posts_with_comments: bool = True
+
+    def __post_init__(self):
+        # Ноль звезд не отправить, а при нуле попыток реакции не отправлялись бы вовсе.
+        for name in ("stars_count", "max_retries"):
+            value = getattr(self, name)
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                raise ValueError(f"Параметр '{name}' должен быть целым числом не меньше 1, получено: {value!r}")
+        for name in ("check_interval", "min_check_interval", "max_check_interval", "api_delay"):
+            value = getattr(self, name)
+            if value is None and name in ("min_check_interval", "max_check_interval"):
+                continue
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+                raise ValueError(f"Параметр '{name}' должен быть неотрицательным числом, получено: {value!r}")
+        if self.min_check_interval is None:
+            self.min_check_interval = min(10, self.check_interval)
+        if self.max_check_interval is None:
+            self.max_check_interval = max(120, self.check_interval)
+        for name in ("enable_reply", "skip_posts_with_comments"):
+            value = getattr(self, name)
+            if not isinstance(value, bool):
+                raise ValueError(f"Параметр '{name}' должен быть true или false, получено: {value!r}")
+        if not isinstance(self.reply_templates, list) or not all(isinstance(t, str) for t in self.reply_templates):
+            raise ValueError(f"Параметр 'reply_templates' должен быть списком строк, получено: {self.reply_templates!r}")
+        if not 0 < self.min_check_interval <= self.check_interval <= self.max_check_interval:
+            raise ValueError(
+                "Интервалы проверки должны удовлетворять условию "
+                "0 < min_check_interval <= check_interval <= max_check_interval."
+            )
+        if self.enable_reply and not self.reply_templates:
+            raise ValueError("Список 'reply_templates' не может быть пустым при включенных комментариях.")
+
 class Config:
     def __init__(self, config_file: str = "config.json", cli_thread_id: Optional[str] = None, reset: bool = False):
         self.config_file = config_file
@@ -65,120 +129,229 @@ class Config:
         if reset or not self._config_exists_and_is_valid():
             self._run_interactive_setup()
 
-        with open(self.config_file, 'r', encoding='utf-8') as f:
-            self._config_data = json.load(f)
+        # Кэшированный объект общий, поэтому конфигурация получает собственную копию.
+        data = self._parse(copy.deepcopy(load_json(self.config_file)))
+        for f in fields(ConfigData):
+            setattr(self, f.name, getattr(data, f.name))
+        if cli_thread_id:
+            self.forum_thread_id = cli_thread_id
         logger.success("Конфигурация успешно загружена.")
 
+    def _parse(self, raw: Dict[str, Any]) -> ConfigData:
+        known = {f.name for f in fields(ConfigData)}
+        unknown = raw.keys() - known
+        if unknown:
+            logger.warning(f"Неизвестные параметры в '{self.config_file}' будут проигнорированы: {', '.join(sorted(unknown))}")
+        try:
+            return ConfigData(**{k: v for k, v in raw.items() if k in known})
+        except TypeError as e:
+            raise ValueError(f"Некорректный файл конфигурации '{self.config_file}': {e}") from e
+
     def _config_exists_and_is_valid(self) -> bool:
         if not os.path.exists(self.config_file):
             return False
         try:
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            config = load_json(self.config_file)
             return config.get("api_id") != "YOUR_API_ID"
         except (json.JSONDecodeError, KeyError):
             return False
 
     def _run_interactive_setup(self):
         logger.info("Запускаю мастер первоначальной настройки...")
-        config = {
-            "api_id": input("Введите ваш API ID: "),
-            "api_hash": input("Введите ваш API Hash: "),
-            "phone_number": input("Введите ваш номер телефона (в международном формате, +...): "),
-            "lolz_token": input("Введите ваш Lolzteam API токен: "),
-            "forum_thread_id": input("Введите ID темы на форуме для отслеживания: "),
-            "stars_count": 3,
-            "check_interval": 30,
-            "api_delay": 5,
-            "max_retries": 3,
-            "processed_posts_file": "processed_posts.json",
-            "enable_reply": True,
-            "reply_templates": ["Готово! Отправил звезды. ⭐", "Выполнено.", "Сделал.", "+rep"],
-            "skip_posts_with_comments": True,
-        }
+        config = asdict(ConfigData(
+            api_id=input("Введите ваш API ID: "),
+            api_hash=input("Введите ваш API Hash: "),
+            phone_number=input("Введите ваш номер телефона (в международном формате, +...): "),
+            lolz_token=input("Введите ваш Lolzteam API токен: "),
+            forum_thread_id=input("Введите ID темы на форуме для отслеживания: "),
+        ))
+        # Границы опроса не фиксируются в файле, а выводятся из check_interval при каждой загрузке.
+        config["min_check_interval"] = None
+        config["max_check_interval"] = None
         with open(self.config_file, 'w', encoding='utf-8') as f:
             json.dump(config, f, indent=4, ensure_ascii=False)
         
         logger.success(f"Конфигурация сохранена в файл '{self.config_file}'.")
         logger.info("Теперь перезапустите скрипт для входа в аккаунт Telegram.")
         sys.exit()
-    
-    def __getattr__(self, name: str) -> Any:
-        if name == "forum_thread_id" and self.cli_thread_id:
-            return self.cli_thread_id
-        return self._config_data.get(name, True if name == "skip_posts_with_comments" else None)
 
 class ProcessedPostsManager:
+    COMPACT_EVERY = 1000
+
     def __init__(self, file_path: str):
         self.file_path = file_path
+        self.log_path = f"{file_path}.log"
         self.processed_posts: Set[int] = self._load()
+        self._appended = 0
+        self._log_fd: Optional[int] = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        atexit.register(self.close)
 
     def _load(self) -> Set[int]:
+        processed_posts = set()
         try:
+            # Снимок читается один раз при запуске, кэшировать его незачем.
             with open(self.file_path, 'r', encoding='utf-8') as f:
-                return set(json.load(f))
+                processed_posts.update(json.load(f))
         except (FileNotFoundError, json.JSONDecodeError):
-            return set()
+            pass
+        try:
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                # Последняя строка может быть недописана, если процесс был прерван.
+                processed_posts.update(int(line) for line in f if line.strip().isdigit())
+        except FileNotFoundError:
+            pass
+        return processed_posts
 
     def _save(self):
-        with open(self.file_path, 'w', encoding='utf-8') as f:
-            json.dump(list(self.processed_posts), f, indent=4)
-
-    def is_processed(self, post_id: int) -> bool:
-        return post_id in self.processed_posts
+        # Снимок пишется во временный файл и атомарно подменяет старый, чтобы сбой не оставил его недописанным.
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(list(self.processed_posts), separators=(',', ':')))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+        # Журнал очищается только после того, как новый снимок и переименование сохранены на диске.
+        # Синхронизация каталога доступна только на POSIX; в Windows его нельзя открыть через os.open.
+        if os.name == "posix":
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.file_path)), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        os.ftruncate(self._log_fd, 0)
+        self._appended = 0
 
     def mark_processed(self, post_id: int):
+        if post_id in self.processed_posts:
+            return
         self.processed_posts.add(post_id)
-        self._save()
+        os.write(self._log_fd, f"{post_id}\n".encode())
+        self._appended += 1
+
+    def maybe_compact(self):
+        if self._appended >= self.COMPACT_EVERY:
+            self._save()
 
     def add_existing_posts(self, post_ids: List[int]):
-        for post_id in post_ids:
-            self.processed_posts.add(post_id)
+        self.processed_posts.update(post_ids)
         self._save()
 
+    def close(self):
+        if self._log_fd is None:
+            return
+        if self._appended:
+            self._save()
+        os.close(self._log_fd)
+        self._log_fd = None
+
 class LolzAPI:
-    def __init__(self, token: str):
+    PAGE_CONCURRENCY = 5
+    COMMENTS_CACHE_SIZE = 1024
+    COMMENTS_CACHE_TTL = 60
+    BACKOFF_BASE = 3
+
+    def __init__(self, token: str, max_retries: int = 3):
         self.base_url = "https://prod-api.lolz.live"
-        self.headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        # Content-Type выставляется aiohttp только для запросов с телом (json=...).
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Бот работает с одним хостом и небольшим числом параллельных запросов.
+        self._connector_kwargs = dict(limit=10, limit_per_host=10, ttl_dns_cache=600, keepalive_timeout=60, enable_cleanup_closed=True)
+        self._semaphore = asyncio.Semaphore(self.PAGE_CONCURRENCY)
+        self._comments_cache: "OrderedDict[int, tuple[float, bool]]" = OrderedDict()
+        self.max_retries = max_retries
+        self._next_allowed = 0.0
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # Сессия создается лениво, уже внутри запущенного event loop.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=30, connect=5),
+                connector=aiohttp.TCPConnector(**self._connector_kwargs),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
 
-    async def _request(self, method: str, endpoint: str, is_retry: bool = False, **kwargs) -> Optional[Dict[str, Any]]:
-        url = f"{self.base_url}{endpoint}"
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.request(method, url, headers=self.headers, **kwargs) as response:
+    @staticmethod
+    def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+        for name in ("Retry-After", "X-RateLimit-Reset"):
+            value = headers.get(name)
+            try:
+                seconds = float(value)
+            except (TypeError, ValueError):
+                continue
+            # X-RateLimit-Reset может содержать абсолютное время в формате Unix.
+            if seconds > 1e9:
+                seconds -= time.time()
+            return max(0.0, seconds)
+        return None
+
+    async def _request(self, method: str, endpoint: str, **kwargs) -> Optional[Dict[str, Any]]:
+        attempts = max(1, self.max_retries)
+        for attempt in range(attempts):
+            # Все запросы ждут окончания паузы, назначенной сервером или предыдущей ошибкой.
+            delay = self._next_allowed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                session = await self._get_session()
+                async with self._semaphore, session.request(method, endpoint, **kwargs) as response:
                     if response.status == 200:
                         return await response.json()
                     
+                    status = response.status
                     error_text = await response.text()
-                    
-                    if response.status == 403 and "Необходимо подождать" in error_text and not is_retry:
-                        logger.warning("Обнаружен флуд-контроль API. Ожидание 3 секунды перед повторной попыткой...")
-                        await asyncio.sleep(3)
-                        return await self._request(method, endpoint, is_retry=True, **kwargs)
-                    
-                    if response.status == 429:
-                        logger.warning("Превышен лимит запросов к API, ожидание 10 секунд...")
-                        await asyncio.sleep(10)
-                    else:
-                        logger.error(f"Ошибка API {response.status} для {url}: {error_text}")
-                    return None
-        except aiohttp.ClientError as e:
-            logger.error(f"Ошибка соединения с API: {e}")
-            return None
+                    retry_after = self._retry_after(response.headers)
+                is_flood = status == 403 and "Необходимо подождать" in error_text
+                retryable = is_flood or status == 429
+                reason = "Обнаружен флуд-контроль API" if is_flood else "Превышен лимит запросов к API"
+            except asyncio.TimeoutError:
+                # Не-GET запрос мог быть выполнен сервером, поэтому повторяются только GET.
+                status, error_text, retry_after = "timeout", "превышено время ожидания ответа", None
+                retryable = method == "GET"
+                reason = "Превышено время ожидания ответа API"
+            except aiohttp.ClientError as e:
+                logger.error(f"Ошибка соединения с API: {e}")
+                return None
+
+            if not retryable or attempt == attempts - 1:
+                break
+
+            if retry_after is None:
+                retry_after = self.BACKOFF_BASE * 2 ** attempt * random.uniform(0.5, 1.5)
+            self._next_allowed = max(self._next_allowed, time.monotonic() + retry_after)
+            logger.warning(f"{reason}. Ожидание {retry_after:.1f} секунд перед повторной попыткой...")
+
+        logger.error(f"Ошибка API {status} для {self.base_url}{endpoint}: {error_text}")
+        return None
 
-    async def get_thread_posts(self, thread_id: Union[str, int], start_page: int = 1) -> List[Dict[str, Any]]:
+    async def _fetch_pages(self, params: Dict[str, Any], start_page: int = 1, stop_after_id: Optional[int] = None) -> List[Dict[str, Any]]:
         all_posts = []
         page = start_page
+        # При известной отметке обычно достаточно одной страницы, поэтому страницы запрашиваются по одной.
+        concurrency = 1 if stop_after_id else self.PAGE_CONCURRENCY
         while True:
-            params = {"thread_id": thread_id, "page": page, "order": "post_date_reverse"}
-            data = await self._request("GET", "/posts", params=params)
-            posts = data.get("posts", []) if data else []
-            if not posts:
-                break
-            all_posts.extend(posts)
-            logger.info(f"Получено {len(posts)} постов из темы {thread_id} на странице {page}.")
-            page += 1
+            pages = range(page, page + concurrency)
+            batch = await asyncio.gather(*[self._request("GET", "/posts", params={**params, "page": p}) for p in pages])
+            for p, data in zip(pages, batch):
+                posts = data.get("posts", []) if data else []
+                if not posts:
+                    return all_posts
+                all_posts.extend(posts)
+                logger.info(f"Получено {len(posts)} постов из темы {params['thread_id']} на странице {p}.")
+                if stop_after_id and min(post.get("post_id") or 0 for post in posts) <= stop_after_id:
+                    return all_posts
+            page += concurrency
             await asyncio.sleep(1)
+
+    async def get_thread_posts(self, thread_id: Union[str, int], start_page: int = 1, stop_after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        params = {"thread_id": thread_id, "order": "post_date_reverse"}
+        all_posts = await self._fetch_pages(params, start_page, stop_after_id)
         if all_posts:
             logger.info(f"Всего получено {len(all_posts)} постов из темы {thread_id}.")
         else:
@@ -186,30 +359,24 @@ class LolzAPI:
         return all_posts
 
     async def get_all_thread_posts(self, thread_id: Union[str, int]) -> List[Dict[str, Any]]:
-        all_posts = []
-        page = 1
-        while True:
-            params = {"thread_id": thread_id, "page": page}
-            data = await self._request("GET", "/posts", params=params)
-            posts = data.get("posts", []) if data else []
-            if not posts:
-                break
-            all_posts.extend(posts)
-            logger.info(f"Получено {len(posts)} постов из темы {thread_id} на странице {page}.")
-            page += 1
-            await asyncio.sleep(1)
-        return all_posts
-
-    async def get_post_comments(self, post_id: int) -> List[Dict[str, Any]]:
-        params = {"post_id": post_id}
-        data = await self._request("GET", "/posts/comments", params=params)
-        if data and "comments" in data:
-            return data["comments"]
-        return []
+        return await self._fetch_pages({"thread_id": thread_id})
 
     async def has_comments(self, post_id: int) -> bool:
-        comments = await self.get_post_comments(post_id)
-        return len(comments) > 0
+        cached = self._comments_cache.get(post_id)
+        if cached and time.monotonic() - cached[0] < self.COMMENTS_CACHE_TTL:
+            self._comments_cache.move_to_end(post_id)
+            return cached[1]
+
+        data = await self._request("GET", "/posts/comments", params={"post_id": post_id, "limit": 1})
+        if data is None:
+            # Ошибки API не кэшируются, чтобы следующий цикл повторил запрос.
+            return False
+        result = bool(data.get("comments"))
+        self._comments_cache[post_id] = (time.monotonic(), result)
+        self._comments_cache.move_to_end(post_id)
+        if len(self._comments_cache) > self.COMMENTS_CACHE_SIZE:
+            self._comments_cache.popitem(last=False)
+        return result
 
     async def create_comment(self, post_id: int, comment_body: str) -> bool:
         payload = {"comment_body": comment_body}
@@ -224,19 +391,24 @@ class LolzAPI:
             return False
 
 class TelegramLinkExtractor:
-    @staticmethod
-    def extract(text: str) -> List[str]:
-        patterns = [
-            r'https?://(?:www\.)?(?:t\.me|telegram\.me)/([a-zA-Z0-9_]+(?:/\d+)?)',
-            r'\[MEDIA=telegram\]([a-zA-Z0-9_]+(?:/\d+)?)\[/MEDIA\]',
-            r'data-telegram-post="([a-zA-Z0-9_]+/\d+)"'
-        ]
-        all_matches = {f"https://t.me/{match}" for p in patterns for match in re.findall(p, text, re.I)}
-        return list(all_matches)
+    _EXTRACT_RE = re.compile(
+        r'https?://(?:www\.)?(?:t\.me|telegram\.me)/(?P<url>[a-zA-Z0-9_]+(?:/\d+)?)'
+        r'|\[MEDIA=telegram\](?P<media>[a-zA-Z0-9_]+(?:/\d+)?)\[/MEDIA\]'
+        r'|data-telegram-post="(?P<data>[a-zA-Z0-9_]+/\d+)"',
+        re.I,
+    )
+    _PARSE_RE = re.compile(r't\.me/([^/]+)(?:/(\d+))?')
+
+    @classmethod
+    def extract(cls, text: str) -> Set[str]:
+        return {
+            f"https://t.me/{m[m.lastgroup]}"
+            for m in cls._EXTRACT_RE.finditer(text)
+        }
 
-    @staticmethod
-    def parse(link: str) -> Optional[tuple[str, Optional[int]]]:
-        match = re.search(r't\.me/([^/]+)(?:/(\d+))?', link)
+    @classmethod
+    def parse(cls, link: str) -> Optional[tuple[str, Optional[int]]]:
+        match = cls._PARSE_RE.search(link)
         if match:
             channel = match.group(1)
             message_id = int(match.group(2)) if match.group(2) else None
@@ -245,13 +417,37 @@ class TelegramLinkExtractor:
 
 class TelegramStarsBot:
     SESSION_NAME = "stars_bot_session"
+    REACTION_CONCURRENCY = 2
+    REACTION_PAUSE = 1.0
+    PERMANENT_ERRORS = (PeerIdInvalid, UsernameNotOccupied, UsernameInvalid, ChannelInvalid, ChannelPrivate)
 
     def __init__(self, config: Config):
         self.config = config
-        self.lolz_api = LolzAPI(config.lolz_token)
+        self.lolz_api = LolzAPI(config.lolz_token, config.max_retries)
         self.processed_manager = ProcessedPostsManager(config.processed_posts_file)
+        # Ссылка на то же множество: менеджер изменяет его на месте и никогда не заменяет.
+        self._processed: Set[int] = self.processed_manager.processed_posts
         self.client: Optional[Client] = None
+        self._send_paid: Optional[Callable[..., Awaitable[Any]]] = None
         self.start_page: int = 1
+        self._highest_seen_post_id: int = 0
+        self._reaction_semaphore = asyncio.Semaphore(self.REACTION_CONCURRENCY)
+        self._pending_comments: List[asyncio.Task] = []
+        self._reply_lock = asyncio.Lock()
+
+        # Часто используемые параметры читаются из конфигурации один раз.
+        self._reply_templates = tuple(config.reply_templates)
+        self._rng = random.Random()
+        self._stars_count = config.stars_count
+        self._max_retries = config.max_retries
+        self._api_delay = config.api_delay
+        self._enable_reply = config.enable_reply
+        self._skip_comments = config.skip_posts_with_comments
+        self._check_interval = config.check_interval
+        self._min_check_interval = config.min_check_interval
+        self._max_check_interval = config.max_check_interval
+        self._idle_rounds = 0
+        self._thread_id = config.forum_thread_id
 
     async def parse_existing_posts(self):
         logger.info("Начинаю парсинг всех существующих постов в теме...")
@@ -265,12 +461,12 @@ class TelegramStarsBot:
             logger.info("Не найдено постов для добавления в обработанные.")
 
     async def send_stars_reaction(self, channel: str, message_id: Optional[int] = None) -> bool:
-        if not hasattr(self.client, 'send_paid_reaction'):
+        if self._send_paid is None:
             logger.error("Платные реакции недоступны. Отправка 'звезд' невозможна.")
             return False
         
         try:
-            for attempt in range(self.config.max_retries):
+            for attempt in range(self._max_retries):
                 try:
                     if message_id is None:
                         async for message in self.client.get_chat_history(f"@{channel}", limit=1):
@@ -281,90 +477,169 @@ class TelegramStarsBot:
                             logger.error(f"Не удалось найти сообщения в канале @{channel}")
                             return False
                     
-                    await self.client.send_paid_reaction(f"@{channel}", message_id, self.config.stars_count)
-                    logger.success(f"Отправлено {self.config.stars_count} звезд в @{channel}/{message_id}")
+                    await self._send_paid(f"@{channel}", message_id, self._stars_count)
+                    logger.success(f"Отправлено {self._stars_count} звезд в @{channel}/{message_id}")
                     return True
                 except FloodWait as e:
-                    logger.warning(f"FloodWait: необходимо подождать {e.x + 2} секунд.")
-                    await asyncio.sleep(e.x + 2)
+                    # В новых версиях Pyrogram время ожидания хранится в e.value, в старых - в e.x.
+                    wait = (getattr(e, "value", None) or getattr(e, "x", 0)) + 2
+                    logger.warning(f"FloodWait: необходимо подождать {wait} секунд.")
+                    await asyncio.sleep(wait)
+                except self.PERMANENT_ERRORS as e:
+                    logger.error(f"Канал @{channel} недоступен, повторные попытки не имеют смысла: {e}")
+                    return False
                 except Exception as e:
                     logger.error(f"Попытка {attempt + 1} отправки звезд не удалась: {e}")
-                    if attempt < self.config.max_retries - 1:
-                        await asyncio.sleep(3 * (attempt + 1))
+                    if attempt < self._max_retries - 1:
+                        await asyncio.sleep(min(30, 2 ** attempt) * self._rng.uniform(0.8, 1.2))
             return False
         except Exception as e:
             logger.error(f"Критическая ошибка при отправке звезд: {e}")
             return False
 
-    async def _process_single_post(self, post: Dict[str, Any]):
-        post_id = post.get("post_id")
-        post_user_id = post.get("poster_user_id")
-        
-        if not post_id or self.processed_manager.is_processed(post_id):
-            return
+    async def _reply_to_post(self, post_id: int, reply_message: str) -> bool:
+        # Комментарии публикуются по одному с паузой api_delay, чтобы не попасть под флуд-контроль форума.
+        async with self._reply_lock:
+            await asyncio.sleep(self._api_delay)
+            return await self.lolz_api.create_comment(post_id, reply_message)
 
+    async def _drain_pending_comments(self):
+        if not self._pending_comments:
+            return
+        tasks = list(self._pending_comments)
+        # В отличие от gather, asyncio.wait не отменяет задачи, если отменяют само ожидание (Ctrl+C).
+        await asyncio.wait(tasks)
+        self._pending_comments = [task for task in self._pending_comments if task not in tasks]
+        for task in tasks:
+            if task.cancelled():
+                logger.error("Публикация комментария была отменена.")
+            elif task.exception() is not None:
+                error = task.exception()
+                logger.error(f"Ошибка при публикации комментария: {error!r}", exc_info=error)
+
+    async def _react_to_target(self, channel: str, message_id: Optional[int], pace: bool) -> bool:
+        async with self._reaction_semaphore:
+            result = await self.send_stars_reaction(channel, message_id)
+            if pace:
+                await asyncio.sleep(self.REACTION_PAUSE)
+            return result
+
+    def _extract_post_links(self, post: Dict[str, Any]) -> Set[str]:
+        post_id = post["post_id"]
         logger.info(f"Найден новый пост для обработки: ID {post_id}")
-        
-        if self.config.skip_posts_with_comments:
-            if await self.lolz_api.has_comments(post_id):
-                logger.info(f"Пост {post_id} уже имеет комментарии. Пропускаю обработку.")
-                self.processed_manager.mark_processed(post_id)
-                return
-        
-        post_content = post.get('post_body_html') or post.get('post_body')
-        if not post_content:
+
+        post_body = post.get('post_body')
+        post_body_html = post.get('post_body_html')
+        if not post_body and not post_body_html:
             logger.warning(f"У поста {post_id} отсутствует содержимое. Пропускаем.")
-            self.processed_manager.mark_processed(post_id)
-            return
+            return set()
 
-        links = TelegramLinkExtractor.extract(post_content)
+        # BB-код короче HTML-версии; HTML сканируется, только если в BB-коде ссылок нет.
+        links = TelegramLinkExtractor.extract(post_body) if post_body else set()
+        if not links and post_body_html:
+            links = TelegramLinkExtractor.extract(post_body_html)
         if not links:
             logger.info(f"В посте {post_id} не найдено ссылок Telegram.")
-            self.processed_manager.mark_processed(post_id)
-            return
+        return links
 
-        successful_reactions = 0
-        for link in links:
-            parsed_link = TelegramLinkExtractor.parse(link)
-            if parsed_link:
-                channel, message_id = parsed_link
-                if await self.send_stars_reaction(channel, message_id):
-                    successful_reactions += 1
-                await asyncio.sleep(1)
-        
-        if successful_reactions > 0 and self.config.enable_reply:
-            await asyncio.sleep(self.config.api_delay)
-            reply_message = random.choice(self.config.reply_templates)
-            
-            if post_user_id:
-                reply_message = f"[userids={post_user_id};align=left]{reply_message}[/userids]"
+    async def _process_single_post(self, post: Dict[str, Any], links: Set[str], already_has_comments: bool):
+        post_id = post["post_id"]
+        post_user_id = post.get("poster_user_id")
+
+        # Пост помечается обработанным ровно один раз, при любом исходе.
+        try:
+            if already_has_comments:
+                logger.info(f"Пост {post_id} уже имеет комментарии. Пропускаю обработку.")
+                return
+
+            # Несколько ссылок на одно и то же сообщение дают одну реакцию.
+            targets = {TelegramLinkExtractor.parse(link) for link in links} - {None}
+            pace = len(targets) > 1
+            results = await asyncio.gather(
+                *[self._react_to_target(channel, message_id, pace) for channel, message_id in targets],
+                return_exceptions=True,
+            )
+            successful_reactions = sum(1 for result in results if result is True)
             
-            await self.lolz_api.create_comment(post_id, reply_message)
+            if successful_reactions > 0 and self._enable_reply:
+                reply_message = self._rng.choice(self._reply_templates)
+                
+                if post_user_id:
+                    reply_message = f"[userids={post_user_id};align=left]{reply_message}[/userids]"
+                
+                # Комментарий публикуется в фоне, не задерживая обработку следующих постов.
+                self._pending_comments.append(asyncio.create_task(self._reply_to_post(post_id, reply_message)))
 
-        logger.info(f"Пост {post_id} полностью обработан.")
-        self.processed_manager.mark_processed(post_id)
+            logger.info(f"Пост {post_id} полностью обработан.")
+        finally:
+            self.processed_manager.mark_processed(post_id)
+
+    def _next_check_delay(self, found_new_posts: bool) -> float:
+        # После новых постов тема проверяется чаще, в тишине интервал растет экспоненциально.
+        if found_new_posts:
+            self._idle_rounds = 0
+            delay = self._min_check_interval
+        else:
+            delay = min(self._max_check_interval, self._check_interval * 2 ** min(self._idle_rounds, 5))
+            self._idle_rounds += 1
+        return delay * self._rng.uniform(0.8, 1.2)
 
     async def _main_loop(self):
         while True:
             try:
-                logger.info(f"Проверка новых постов в теме {self.config.forum_thread_id} начиная со страницы {self.start_page}...")
-                posts = await self.lolz_api.get_thread_posts(self.config.forum_thread_id, self.start_page)
+                new_posts = 0
+                logger.info(f"Проверка новых постов в теме {self._thread_id} начиная со страницы {self.start_page}...")
+                posts = await self.lolz_api.get_thread_posts(
+                    self._thread_id, self.start_page, stop_after_id=self._highest_seen_post_id
+                )
                 
                 if posts:
+                    # Дешевые локальные проверки выполняются до запросов к API:
+                    # посты без содержимого и без ссылок сразу помечаются обработанными.
+                    candidates = []
                     for post in reversed(posts):
-                        await self._process_single_post(post)
+                        post_id = post.get("post_id")
+                        # Посты не новее отметки уже разобраны в прошлых циклах.
+                        if not post_id or post_id <= self._highest_seen_post_id:
+                            continue
+                        if post_id in self._processed:
+                            continue
+                        new_posts += 1
+                        links = self._extract_post_links(post)
+                        if links:
+                            candidates.append((post, links))
+                        else:
+                            self.processed_manager.mark_processed(post_id)
+
+                    if self._skip_comments:
+                        has_comment_flags = await asyncio.gather(
+                            *[self.lolz_api.has_comments(post["post_id"]) for post, _ in candidates]
+                        )
+                    else:
+                        has_comment_flags = [False] * len(candidates)
+                    for (post, links), has_comments in zip(candidates, has_comment_flags):
+                        await self._process_single_post(post, links, has_comments)
+
+                    await self._drain_pending_comments()
+
+                    # Отметка сдвигается только после обработки всех постов цикла.
+                    self._highest_seen_post_id = max(
+                        self._highest_seen_post_id, *(post.get("post_id") or 0 for post in posts)
+                    )
+                    self.processed_manager.maybe_compact()
                 else:
                     logger.info("Новых постов для обработки не найдено.")
                 
-                logger.info(f"Ожидание {self.config.check_interval} секунд...")
-                await asyncio.sleep(self.config.check_interval)
+                delay = self._next_check_delay(new_posts > 0)
+                logger.info(f"Ожидание {delay:.0f} секунд...")
+                await asyncio.sleep(delay)
             
             except KeyboardInterrupt:
                 logger.info("Получен сигнал прерывания (Ctrl+C).")
                 break
             except Exception as e:
                 logger.exception(f"Критическая ошибка в главном цикле: {e}")
-                await asyncio.sleep(self.config.check_interval)
+                await asyncio.sleep(self._check_interval)
 
     async def start(self):
         is_first_login = not os.path.exists(f"{self.SESSION_NAME}.session")
@@ -377,7 +652,10 @@ class TelegramStarsBot:
                 logger.info("Выбран режим парсинга существующих постов.")
                 self.client = Client(self.SESSION_NAME, self.config.api_id, self.config.api_hash)
                 await self.client.start()
-                await self.parse_existing_posts()
+                try:
+                    await self.parse_existing_posts()
+                finally:
+                    await self.lolz_api.close()
                 await self.client.stop()
                 logger.success("Парсинг завершен. Все существующие посты добавлены в обработанные.")
                 return
@@ -397,6 +675,8 @@ class TelegramStarsBot:
         try:
             await self.client.start()
             logger.success("Клиент Telegram успешно запущен.")
+            # Наличие метода не меняется за время работы, поэтому проверяется один раз.
+            self._send_paid = getattr(self.client, 'send_paid_reaction', None)
 
             if is_first_login:
                 logger.success("Аккаунт Telegram успешно подключен.")
@@ -412,6 +692,10 @@ class TelegramStarsBot:
             await self._main_loop()
 
         finally:
+            # Посты с ожидающими комментариями уже помечены обработанными, поэтому комментарии дожидаются здесь.
+            await self._drain_pending_comments()
+            await self.lolz_api.close()
+            self.processed_manager.close()
             if self.client and self.client.is_connected:
                 await self.client.stop()
             logger.info("Бот остановлен.")